@@ -1,8 +1,9 @@
-import json
 import time
 import argparse
 from pathlib import Path
 
+import orjson
+
 try:
     from . import algoritmos_ordenamiento
 except ImportError:
@@ -65,8 +66,7 @@ def cargar_dataset_desde_historicos(ruta_hist):
 
         tic_arch = archivo.name.replace("_historico.json", "")
 
-        with archivo.open("r", encoding="utf-8") as f:
-            contenido = json.load(f)
+        contenido = orjson.loads(archivo.read_bytes())
 
         if not isinstance(contenido, list):
             continue
@@ -241,8 +241,9 @@ def top_15_mayor_volumen_por_activo(datos_unif):
 
 def guardar_json(ruta, data):
     ruta.parent.mkdir(parents=True, exist_ok=True)
-    with ruta.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    ruta.write_bytes(
+        orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    )
 
 
 def ejecutar_analisis_ordenamiento(
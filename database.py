@@ -37,14 +37,13 @@ from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from pymongo.database import Database
-from pymongo.errors import ServerSelectionTimeoutError, ConfigurationError
+from pymongo.errors import ServerSelectionTimeoutError, ConfigurationError, OperationFailure
 
 # ── Logger Setup ──────────────────────────────────────────────────────────────
+# Sin basicConfig aquí: lo configura cada punto de entrada (main.py para la
+# API). Importar este módulo desde el ETL no debe activar logs INFO de
+# librerías como httpx, que taparían la barra de progreso.
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
 
 # ── Environment Configuration ─────────────────────────────────────────────────
 # Carga variables de entorno desde .env
@@ -78,8 +77,16 @@ MONGO_CONFIG = {
     "serverSelectionTimeoutMS": 10000,
     "connectTimeoutMS": 10000,
     "socketTimeoutMS": 20000,
-    "maxPoolSize": 10,
+    # Escritores MongoDB del ETL: UPLOAD_WORKERS hilos (etl/storage.py) y,
+    # en finalInfoScript, un flush (asyncio.to_thread) por activo cada
+    # MONGO_FLUSH_ROWS registros (pueden solaparse si MongoDB va lento).
+    # Los BVC_WORKERS son corrutinas httpx y no usan este pool.
+    "maxPoolSize": 50,
     "minPoolSize": 5,
+    # Compresión de protocolo: el servidor elige la primera que soporte.
+    # zlib (stdlib) queda como respaldo si faltan zstandard/python-snappy.
+    "compressors": "zstd,snappy,zlib",
+    "zlibCompressionLevel": -1,
 }
 
 
@@ -183,6 +190,39 @@ def close_connection() -> None:
         logger.debug("No hay conexión activa para cerrar")
 
 
+def ensure_historico_indexes(db: Database) -> int:
+    """
+    Crea el índice único sobre `date` en cada colección historico_*.
+    
+    Es el mismo índice que crea el ETL (etl/storage.py), así que la
+    operación es idempotente. Con él, los filtros por rango de fechas y el
+    sort("date") se resuelven en MongoDB sin ordenar en memoria.
+    
+    Args:
+        db: Base de datos MongoDB
+        
+    Returns:
+        int: Cantidad de colecciones con el índice disponible
+        
+    Example:
+        @app.on_event("startup")
+        def startup_event():
+            ensure_historico_indexes(get_client()[MONGO_DB_NAME])
+    """
+    indexed = 0
+    for name in db.list_collection_names():
+        if not name.startswith("historico_"):
+            continue
+        try:
+            db[name].create_index("date", unique=True)
+            indexed += 1
+        except OperationFailure as e:
+            # Fechas duplicadas o un índice previo con otras opciones
+            logger.warning(f"No se pudo crear índice date en {name}: {e}")
+    logger.info(f"Índice date verificado en {indexed} colecciones históricas")
+    return indexed
+
+
 def is_connected() -> bool:
     """
     Verifica si hay una conexión activa a MongoDB.
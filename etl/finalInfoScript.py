@@ -5,23 +5,50 @@ Descarga histórica BVC al máximo de velocidad.
 
 Optimizaciones clave:
   1. 1 request por fecha = TODOS los activos (no 1 request por activo/fecha)
-  2. ThreadPoolExecutor con N hilos — cada hilo procesa UNA fecha
-  3. Session reutilizable por hilo (via threading.local)
-  4. Sin sleep innecesario — solo retry real en errores
+  2. asyncio + httpx — BVC_WORKERS corrutinas consumen las fechas de una cola
+     acotada en un solo event loop (requests y corrutinas en vuelo acotados
+     por BVC_WORKERS; los resultados sí se acumulan hasta el final)
+  3. Un solo AsyncClient HTTP/2 compartido (requests multiplexados sobre
+     pocas conexiones TLS)
+  4. Sin sleep fijo — solo retry real en errores; BVC_RATE_PER_SEC permite
+     activar un token bucket si la BVC empieza a limitar
   5. Barra de progreso en tiempo real con ETA
   6. TODOS los activos del script original incluidos
+  7. Los registros van directo a MongoDB (lotes de MONGO_FLUSH_ROWS por activo)
+     a medida que llegan — sin pasar por disco
+
+Uso (desde la raíz del repo):
+    python -m etl.finalInfoScript               # descarga → MongoDB
+    python -m etl.finalInfoScript --save-json   # además vuelca etl/historicos/*.json
+
+Los JSON de etl/historicos son los que lee algorithms/desempeno.py; usa
+--save-json para refrescarlos.
 """
 
+import argparse
+import asyncio
+import httpx
 import requests
-import uuid
+from requests.adapters import HTTPAdapter
 import time
 import base64
-import json
+import functools
 import os
+import orjson
 import threading
+import holidays
+import numpy as np
 from datetime import date, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+try:
+    import uvloop   # event loop más rápido; no existe en Windows
+except ImportError:
+    uvloop = None
+
+from database import MONGO_DB_NAME, get_client
+from etl.storage import historico_collection, write_records
+
 # ============================================================
 # CONFIGURACIÓN — todos los activos originales
 # ============================================================
@@ -44,41 +71,118 @@ BVC_ASSETS = [
     {"mnemonic": "PFDAVVNDA",  "board": "EQTY"},
 ]
 
+# Claves (mnemonic, board) buscadas en cada respuesta BVC; el set de
+# mnemonics descarta la mayoría de filas sin armar la tupla
+_WANTED = frozenset((a["mnemonic"], a["board"]) for a in BVC_ASSETS)
+_WANTED_MNEMONICS = frozenset(mn for mn, _ in _WANTED)
+
 YAHOO_ASSETS = ["VOO", "CSPX.L", "SPY", "QQQ", "IVV", "GLD"]
 
 YEARS_BACK     = 5
 MAX_RETRY_DAYS = 7
+
+# Calendario bursátil: lunes a viernes sin festivos colombianos. Los festivos
+# no entran a la cola ni se usan como reintento (la BVC no opera esos días)
+_BVC_CALENDAR = np.busdaycalendar(holidays=np.array(
+    sorted(holidays.CO(years=range(date.today().year - YEARS_BACK - 1, date.today().year + 2))),
+    dtype="datetime64[D]",
+))
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "historicos")
 
+# Manifiesto de días BVC ya descargados. Un día con más de FINAL_AFTER_DAYS
+# días de antigüedad ya no cambia: la siguiente corrida lo toma de aquí sin
+# pedirlo a la BVC (igual se reenvía a MongoDB)
+MANIFEST_PATH    = os.path.join(OUTPUT_DIR, "_manifest.json")
+FINAL_AFTER_DAYS = 7
+
 # Ajusta según tu conexión. 20-30 es el sweet spot para la BVC.
-BVC_WORKERS   = 25
+BVC_WORKERS   = 25  # requests BVC simultáneos (corrutinas, no hilos)
+BVC_QUEUE_SIZE    = BVC_WORKERS * 4       # fechas encoladas por delante de los workers
+
+# Techo opcional de requests a la BVC (handshake incluido): ráfaga de
+# BVC_RATE_CAPACITY y luego BVC_RATE_PER_SEC sostenidos, repartidos entre
+# todas las corrutinas. None = sin techo, solo BVC_WORKERS en vuelo. Con un
+# techo, la descarga tarda al menos fechas / BVC_RATE_PER_SEC segundos
+# (p. ej. 10 req/s → ~125 s para ~1250 fechas) sin importar BVC_WORKERS.
+BVC_RATE_CAPACITY = 10
+BVC_RATE_PER_SEC: float | None = None
+
+MONGO_FLUSH_ROWS = 500   # registros pendientes por activo antes de enviar un lote
 YAHOO_WORKERS = 3   # más bajo para no saturar Yahoo con sesiones simultáneas
+JSON_SAVE_WORKERS = 8   # tope de archivos escribiéndose a la vez (--save-json)
 
 # ============================================================
 # ESTADO COMPARTIDO — thread-safe
 # ============================================================
 
 print_lock = threading.Lock()
-_tls = threading.local()   # sesión requests por hilo
 
+BVC_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept":     "application/json",
+    "Origin":     "https://www.bvc.com.co",
+    "Referer":    "https://www.bvc.com.co/",
+}
+
+# Cliente BVC — se crea dentro del event loop en bvc_download_all()
+_bvc_session: httpx.AsyncClient | None = None
+
+class TokenBucket:
+    """
+    Limitador token-bucket para el event loop: `capacity` fichas que se
+    reponen a `refill_per_sec` por segundo. acquire() duerme solo lo
+    necesario para obtener una ficha — sin pausas fijas entre requests.
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity,
+                    self.tokens + (now - self.updated) * self.refill_per_sec,
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.refill_per_sec)
+
+_bvc_bucket: TokenBucket | None = None   # None si BVC_RATE_PER_SEC es None
+
+async def bvc_throttle():
+    """Espera una ficha de _bvc_bucket, si hay techo configurado."""
+    if _bvc_bucket is not None:
+        await _bvc_bucket.acquire()
+
+# Token BVC compartido por toda la sesión — se renueva al vencer su TTL
+# o ante un 401/403
+BVC_TOKEN_TTL = 300   # s
+_bvc_token = {"token": None, "expires": 0.0}
+_bvc_token_lock: asyncio.Lock | None = None
+
+# Contadores BVC — solo los modifica el bucle de bvc_download_all(), en el
+# hilo del event loop, así que no necesitan lock
 progress = {
     "bvc_done": 0, "bvc_total": 0,
-    "bvc_ok": 0,   "bvc_skip": 0, "bvc_errors": 0,
-    "start_time": 0.0,
+    "bvc_ok": 0,   "bvc_skip": 0, "bvc_errors": 0, "bvc_cached": 0,
+    "start_time": 0.0, "last_date": "",
 }
 
-def get_session() -> requests.Session:
-    """Una sesión requests reutilizable por hilo."""
-    if not hasattr(_tls, "session"):
-        s = requests.Session()
-        s.headers.update({
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-            "Accept":     "application/json",
-            "Origin":     "https://www.bvc.com.co",
-            "Referer":    "https://www.bvc.com.co/",
-        })
-        _tls.session = s
-    return _tls.session
+PROGRESS_INTERVAL = 0.25   # s entre repintados de la barra BVC
+
+async def report_progress():
+    """Repinta la barra cada PROGRESS_INTERVAL hasta que la cancelen."""
+    while True:
+        print_bar(progress["last_date"])
+        await asyncio.sleep(PROGRESS_INTERVAL)
 
 def print_bar(current_date: str = ""):
     """Imprime barra de progreso en la misma línea."""
@@ -109,103 +213,138 @@ def print_bar(current_date: str = ""):
 # BVC — núcleo de descarga
 # ============================================================
 
-def bvc_token(session: requests.Session) -> str:
-    ts = int(time.time() * 1000)
-    r  = str(uuid.uuid4())
-    resp = session.get(
+async def bvc_token(session: httpx.AsyncClient) -> str:
+    ts = time.time_ns() // 1_000_000   # epoch en ms
+    r  = os.urandom(16).hex()          # nonce aleatorio, sin objeto UUID
+    await bvc_throttle()
+    resp = await session.get(
         "https://www.bvc.com.co/api/handshake",
         params={"ts": ts, "r": r},
-        timeout=15,
     )
     resp.raise_for_status()
-    return resp.json()["token"]
+    return orjson.loads(resp.content)["token"]
 
+async def cached_bvc_token(session: httpx.AsyncClient, stale: str | None = None) -> str:
+    """
+    Devuelve el token cacheado mientras no esté por vencer. Si vence, o si
+    `stale` es el token vigente (la BVC lo rechazó), pide uno nuevo; con
+    doble chequeo bajo el lock, solo la primera corrutina lo renueva.
+    """
+    def valid() -> bool:
+        token = _bvc_token["token"]
+        return (token is not None and token != stale
+                and time.time() < _bvc_token["expires"] - 5)
+
+    if valid():
+        return _bvc_token["token"]
+    async with _bvc_token_lock:
+        if not valid():
+            _bvc_token["token"]   = await bvc_token(session)
+            _bvc_token["expires"] = time.time() + BVC_TOKEN_TTL
+        return _bvc_token["token"]
+
+# Cabecera `k`: query en base64 — solo tradeDate varía entre requests
+_K_PREFIX = b"filters[marketDataRv][tradeDate]="
+_K_SUFFIX = (
+    b"&filters[marketDataRv][board]=EQTY"
+    b"&sorter[]=tradeValue&sorter[]=DESC"
+)
+
+# Resto de la query lvl-2 (mismo orden que `k`); se arma una sola vez
+_LVL2_PARAMS = (
+    ("filters[marketDataRv][board]", "EQTY"),
+    ("sorter[]",                     "tradeValue"),
+    ("sorter[]",                     "DESC"),
+)
+
+@functools.lru_cache(maxsize=4096)
 def k_header(trade_date: str) -> str:
-    q = (
-        f"filters[marketDataRv][tradeDate]={trade_date}"
-        "&filters[marketDataRv][board]=EQTY"
-        "&filters[marketDataRv][board]=REPO"
-        "&filters[marketDataRv][board]=TTV"
-        "&sorter[]=tradeValue&sorter[]=DESC"
-    )
-    return base64.b64encode(q.encode()).decode()
-
-def fetch_day(session: requests.Session, trade_date: str) -> list:
-    """1 request → todos los activos del día."""
-    token = bvc_token(session)
-    r = session.get(
-        "https://rest.bvc.com.co/market-information/rv/lvl-2",
-        params={
-            "filters[marketDataRv][tradeDate]": trade_date,
-            "filters[marketDataRv][board]":     ["EQTY", "REPO", "TTV"],
-            "sorter[]":                         ["tradeValue", "DESC"],
-        },
-        headers={"token": token, "k": k_header(trade_date)},
-        timeout=15,
-    )
-    r.raise_for_status()
-    return r.json().get("data", {}).get("tab", [])
+    return base64.b64encode(_K_PREFIX + trade_date.encode() + _K_SUFFIX).decode()
 
-def worker_day(trade_date_str: str, asset_set: set) -> dict:
+async def fetch_day(session: httpx.AsyncClient, trade_date: str) -> bytes:
     """
-    Worker por fecha. Busca datos en trade_date_str y hasta
-    MAX_RETRY_DAYS días siguientes si ese día no tiene datos.
-    Devuelve { mnemonic: record_dict }.
+    1 request → todos los activos del día (token cacheado, 1 reintento si expira).
+    Solo se pide el tablero EQTY: todos los BVC_ASSETS cotizan ahí.
+    Devuelve el cuerpo crudo; lo parsea decode_day.
     """
-    session = get_session()
-    base    = date.fromisoformat(trade_date_str)
-
-    tab, used_date = [], None
-    for delta in range(MAX_RETRY_DAYS):
-        candidate = base + timedelta(days=delta)
-        while candidate.weekday() >= 5:          # saltar fin de semana
-            candidate += timedelta(days=1)
-        cstr = candidate.strftime("%Y-%m-%d")
-        try:
-            tab = fetch_day(session, cstr)
-            if tab:
-                used_date = cstr
-                break
-        except Exception:
-            time.sleep(0.3)
-
-    result = {}
+    params = (("filters[marketDataRv][tradeDate]", trade_date),) + _LVL2_PARAMS
+    k      = k_header(trade_date)
+    token  = await cached_bvc_token(session)
+    for attempt in range(2):
+        await bvc_throttle()
+        r = await session.get(
+            "https://rest.bvc.com.co/market-information/rv/lvl-2",
+            params=params,
+            headers={"token": token, "k": k},
+        )
+        if r.status_code in (401, 403) and attempt == 0:
+            token = await cached_bvc_token(session, stale=token)
+            continue
+        r.raise_for_status()
+        return r.content
 
+def decode_day(body: bytes, used_date: str, trade_date_str: str) -> dict | None:
+    """
+    Parsea la respuesta BVC y extrae los BVC_ASSETS. Corre en el event loop:
+    con solo el tablero EQTY, orjson tarda ~0.2 ms por día.
+    Devuelve { mnemonic: record_dict }, o None si el día no tiene datos.
+    """
+    tab = orjson.loads(body).get("data", {}).get("tab", [])
     if not tab:
-        with print_lock:
-            progress["bvc_skip"]  += 1
-            progress["bvc_done"]  += 1
-        print_bar(trade_date_str)
-        return result
-
-    # Índice O(1)
-    idx = {(x["mnemonic"], x["board"]): x for x in tab}
-
-    for a in BVC_ASSETS:
-        mn  = a["mnemonic"]
-        brd = a["board"]
-        row = idx.get((mn, brd))
-        if row and row.get("lastPrice") is not None:
-            result[mn] = {
-                "date":                used_date,
-                "targetDate":          trade_date_str,
-                "open":                row.get("openPrice"),
-                "high":                row.get("maximumPrice"),
-                "low":                 row.get("minimumPrice"),
-                "close":               row.get("lastPrice"),
-                "volume":              row.get("volume"),
-                "averagePrice":        row.get("averagePrice"),
-                "absoluteVariation":   row.get("absoluteVariation"),
-                "percentageVariation": row.get("percentageVariation"),
-                "mnemonic":            mn,
-                "board":               brd,
-            }
-
-    with print_lock:
-        progress["bvc_ok"]   += len(result)
-        progress["bvc_done"] += 1
-    print_bar(trade_date_str)
-    return result
+        return None
+
+    # Una sola pasada sobre tab, quedándonos solo con los activos pedidos
+    return {
+        mn: bvc_record(row, used_date, trade_date_str)
+        for row in tab
+        if (mn := row["mnemonic"]) in _WANTED_MNEMONICS
+        and (mn, row["board"]) in _WANTED
+        and row.get("lastPrice") is not None
+    }
+
+def bvc_record(row: dict, used_date: str, trade_date_str: str) -> dict:
+    """Fila del tab BVC → registro histórico."""
+    return {
+        "date":                used_date,
+        "targetDate":          trade_date_str,
+        "open":                row.get("openPrice"),
+        "high":                row.get("maximumPrice"),
+        "low":                 row.get("minimumPrice"),
+        "close":               row.get("lastPrice"),
+        "volume":              row.get("volume"),
+        "averagePrice":        row.get("averagePrice"),
+        "absoluteVariation":   row.get("absoluteVariation"),
+        "percentageVariation": row.get("percentageVariation"),
+        "mnemonic":            row["mnemonic"],
+        "board":               row["board"],
+    }
+
+async def worker_day(idx: int, trading_days: list[str]) -> dict | None:
+    """
+    Corrutina por fecha. Busca datos en trading_days[idx] y, si ese día no
+    tiene datos, en los hasta MAX_RETRY_DAYS - 1 días hábiles siguientes de
+    la misma lista (ya sin fines de semana ni festivos).
+    Devuelve { mnemonic: record_dict }, o None si ningún día tuvo datos.
+    Si ningún día tuvo datos y algún intento falló, relanza el último error
+    para que cuente como error y no como día sin datos.
+    """
+    trade_date_str = trading_days[idx]
+    error = None
+
+    for cstr in trading_days[idx:idx + MAX_RETRY_DAYS]:
+        try:
+            body   = await fetch_day(_bvc_session, cstr)
+            result = decode_day(body, cstr, trade_date_str)
+            if result is not None:
+                return result
+        except Exception as e:
+            # Sin pausa fija: se pasa al siguiente día hábil (con techo
+            # configurado, el intento espera su ficha en bvc_throttle)
+            error = e
+
+    if error is not None:
+        raise error
+    return None
 
 # ============================================================
 # YAHOO FINANCE — endpoint v8 con cookie/crumb (fix 401)
@@ -215,6 +354,8 @@ def worker_day(trade_date_str: str, asset_set: set) -> dict:
 _yahoo_crumb: str | None = None
 _yahoo_crumb_lock = threading.Lock()
 _yahoo_session: requests.Session | None = None
+_yahoo_renewed_at = 0.0          # time.time() de la última renovación (no de la creación)
+YAHOO_RENEW_COOLDOWN = 30        # s — no renovar la sesión más de una vez por ventana
 
 YAHOO_HEADERS = {
     "User-Agent":      "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
@@ -237,6 +378,11 @@ def yahoo_init_session() -> tuple:
     """
     s = requests.Session()
     s.headers.update(YAHOO_HEADERS)
+    # Una sola sesión para todos los hilos Yahoo: pool keep-alive por host
+    # (consent, finance, query1, query2) con cupo para YAHOO_WORKERS hilos
+    s.mount("https://", HTTPAdapter(
+        pool_connections=4, pool_maxsize=YAHOO_WORKERS * 2, max_retries=0,
+    ))
 
     # Paso 1 — aceptar consent si aparece (Europa/LATAM)
     try:
@@ -251,25 +397,26 @@ def yahoo_init_session() -> tuple:
     # Paso 2 — visitar página del ticker para fijar cookies __cf_bm, etc.
     try:
         s.get("https://finance.yahoo.com/quote/SPY/history/", timeout=15)
-        time.sleep(1)  # dar tiempo a que las cookies se asienten
     except Exception:
         pass
 
-    # Paso 3 — obtener crumb (intentar ambos subdominios)
+    # Paso 3 — obtener crumb (intentar ambos subdominios, backoff exponencial)
     crumb = None
     for endpoint in [
         "https://query1.finance.yahoo.com/v1/test/getcrumb",
         "https://query2.finance.yahoo.com/v1/test/getcrumb",
     ]:
+        delay = 0.25
         for _ in range(3):
             try:
                 r = s.get(endpoint, timeout=10)
-                if r.status_code == 200 and r.text.strip() and r.text.strip() != "":
+                if r.status_code == 200 and r.text.strip():
                     crumb = r.text.strip()
                     break
-                time.sleep(1)
             except Exception:
-                time.sleep(1)
+                pass
+            time.sleep(delay)
+            delay *= 2
         if crumb:
             break
 
@@ -280,6 +427,7 @@ def get_yahoo_session_and_crumb():
     global _yahoo_crumb, _yahoo_session
     with _yahoo_crumb_lock:
         if _yahoo_session is None:
+            # _yahoo_renewed_at queda en 0: el primer 401/403 sí renueva
             _yahoo_session, _yahoo_crumb = yahoo_init_session()
             if _yahoo_crumb:
                 print(f"  [Yahoo] Sesión lista — crumb: {_yahoo_crumb[:10]}...")
@@ -287,20 +435,27 @@ def get_yahoo_session_and_crumb():
                 print("  [Yahoo] ⚠ Sin crumb — se intentará sin él")
     return _yahoo_session, _yahoo_crumb
 
+def renew_yahoo_session(stale: requests.Session) -> tuple:
+    """
+    Renueva la sesión compartida tras un 401/403 (thread-safe).
+    Si otro hilo ya la renovó, o la última renovación fue hace menos de
+    YAHOO_RENEW_COOLDOWN segundos, devuelve la sesión vigente sin tocarla.
+    """
+    global _yahoo_crumb, _yahoo_session, _yahoo_renewed_at
+    with _yahoo_crumb_lock:
+        if (_yahoo_session is stale
+                and time.time() - _yahoo_renewed_at >= YAHOO_RENEW_COOLDOWN):
+            _yahoo_session, _yahoo_crumb = yahoo_init_session()
+            _yahoo_renewed_at = time.time()
+        return _yahoo_session, _yahoo_crumb
+
 def download_yahoo_ticker(ticker: str, start: date, end: date) -> list:
     import calendar as _cal
     p1 = int(_cal.timegm(start.timetuple()))
     p2 = int(_cal.timegm(end.timetuple()))
 
-    # Cada ticker usa su propia sesión independiente para evitar
-    # que la sesión compartida se rate-limite con 6 hilos simultáneos
-    session, crumb = yahoo_init_session()
-    if crumb:
-        with print_lock:
-            print(f"  [Yahoo] {ticker} — sesión lista (crumb: {crumb[:8]}...)")
-    else:
-        with print_lock:
-            print(f"  [Yahoo] {ticker} — ⚠ sin crumb, intentando igual")
+    # Sesión + crumb compartidos por todos los tickers (se crean una sola vez)
+    session, crumb = get_yahoo_session_and_crumb()
 
     records = _yahoo_v8_json(session, ticker, p1, p2, crumb)
     if not records:
@@ -308,6 +463,53 @@ def download_yahoo_ticker(ticker: str, start: date, end: date) -> list:
 
     return records
 
+def _yahoo_records(ticker, days, open_, high, low, close, adj, volume) -> list:
+    """
+    Arma los registros Yahoo a partir de columnas float64 (nan = faltante).
+    Descarta filas sin cierre, rellena nan con 0 (adjClose → close) y
+    redondea a 6 decimales en bloque; .tolist() deja tipos Python nativos.
+    """
+    mask   = ~np.isnan(close)
+    close  = close[mask]
+    adj    = adj[mask]
+    adj    = np.where(np.isnan(adj) | (adj == 0), close, adj)   # sin ajuste → cierre
+
+    keys = ("date", "open", "high", "low", "close", "adjClose", "volume")
+    rows = zip(
+        days[mask].tolist(),
+        np.round(np.nan_to_num(open_[mask]), 6).tolist(),
+        np.round(np.nan_to_num(high[mask]),  6).tolist(),
+        np.round(np.nan_to_num(low[mask]),   6).tolist(),
+        np.round(close, 6).tolist(),
+        np.round(adj,   6).tolist(),
+        np.nan_to_num(volume[mask]).astype(np.int64).tolist(),
+    )
+    return [dict(zip(keys, row), ticker=ticker) for row in rows]
+
+def _csv_column(cells, header, *names) -> tuple:
+    """
+    Columna del CSV v7 → (float64, inválidas). Vacío o "null" → nan; una
+    celda no numérica también queda en nan y se marca en `inválidas` para
+    descartar solo su fila (como el parseo fila a fila original).
+    """
+    for name in names:
+        if name in header:
+            col = np.char.strip(cells[:, header.index(name)])
+            col[(col == "") | (np.char.lower(col) == "null")] = "nan"
+            try:
+                return col.astype(np.float64), np.zeros(len(col), dtype=bool)
+            except ValueError:
+                # Camino lento, solo para columnas con alguna celda corrupta
+                values  = np.full(len(col), np.nan)
+                invalid = np.zeros(len(col), dtype=bool)
+                for i, cell in enumerate(col.tolist()):
+                    try:
+                        values[i] = float(cell)
+                    except ValueError:
+                        invalid[i] = True
+                return values, invalid
+    return np.full(len(cells), np.nan), np.zeros(len(cells), dtype=bool)
+
 def _yahoo_v8_json(session, ticker, p1, p2, crumb) -> list:
     """Endpoint moderno — devuelve OHLCV como JSON."""
     url = (
@@ -323,10 +525,7 @@ def _yahoo_v8_json(session, ticker, p1, p2, crumb) -> list:
             # Reinicializar sesión y reintentar UNA vez
             with print_lock:
                 print(f"\n  [Yahoo] {r.status_code} en {ticker}, renovando sesión...")
-            global _yahoo_session, _yahoo_crumb
-            with _yahoo_crumb_lock:
-                _yahoo_session, _yahoo_crumb = yahoo_init_session()
-            session, crumb = _yahoo_session, _yahoo_crumb
+            session, crumb = renew_yahoo_session(session)
             url = (
                 f"https://query1.finance.yahoo.com/v8/finance/chart/{ticker}"
                 f"?period1={p1}&period2={p2}&interval=1d&events=history&includeAdjustedClose=true"
@@ -336,28 +535,32 @@ def _yahoo_v8_json(session, ticker, p1, p2, crumb) -> list:
             r = session.get(url, timeout=30)
 
         r.raise_for_status()
-        data      = r.json()
+        data      = orjson.loads(r.content)
         result    = data["chart"]["result"][0]
         timestamps = result.get("timestamp", [])
         ohlcv     = result["indicators"]["quote"][0]
         adj_close = result["indicators"].get("adjclose", [{}])[0].get("adjclose", [])
 
-        records = []
-        for i, ts in enumerate(timestamps):
-            close_val = ohlcv["close"][i]
-            if close_val is None:
-                continue
-            records.append({
-                "date":     date.fromtimestamp(ts).isoformat(),
-                "open":     round(ohlcv["open"][i]   or 0, 6),
-                "high":     round(ohlcv["high"][i]   or 0, 6),
-                "low":      round(ohlcv["low"][i]    or 0, 6),
-                "close":    round(close_val,            6),
-                "adjClose": round(adj_close[i] if adj_close and i < len(adj_close) and adj_close[i] else close_val, 6),
-                "volume":   int(ohlcv["volume"][i]   or 0),
-                "ticker":   ticker,
-            })
-        return records
+        if not timestamps:
+            return []
+
+        # Columnas → arrays float64 (None → nan)
+        n   = len(timestamps)
+        adj = np.full(n, np.nan)
+        if adj_close:
+            adj[:min(n, len(adj_close))] = np.asarray(adj_close[:n], dtype=np.float64)
+        days = np.asarray(timestamps, dtype="datetime64[s]").astype("datetime64[D]")
+
+        return _yahoo_records(
+            ticker,
+            days.astype(str),
+            np.asarray(ohlcv["open"],   dtype=np.float64),
+            np.asarray(ohlcv["high"],   dtype=np.float64),
+            np.asarray(ohlcv["low"],    dtype=np.float64),
+            np.asarray(ohlcv["close"],  dtype=np.float64),
+            adj,
+            np.asarray(ohlcv["volume"], dtype=np.float64),
+        )
     except Exception as e:
         with print_lock:
             print(f"\n  [Yahoo v8 ✗] {ticker}: {e}")
@@ -378,28 +581,28 @@ def _yahoo_v7_csv(session, ticker, p1, p2, crumb) -> list:
         if len(lines) < 2:
             return []
         header = [h.strip().lower() for h in lines[0].split(",")]
-        records = []
-        for line in lines[1:]:
-            parts = line.strip().split(",")
-            if len(parts) < len(header):
-                continue
-            row = dict(zip(header, parts))
-            if not row.get("close") or "null" in row["close"].lower():
-                continue
-            try:
-                records.append({
-                    "date":     row.get("date", ""),
-                    "open":     float(row.get("open")   or 0),
-                    "high":     float(row.get("high")   or 0),
-                    "low":      float(row.get("low")    or 0),
-                    "close":    float(row.get("close")  or 0),
-                    "adjClose": float(row.get("adj close", row.get("adjclose", 0)) or 0),
-                    "volume":   int(float(row.get("volume", 0) or 0)),
-                    "ticker":   ticker,
-                })
-            except (ValueError, TypeError):
-                continue
-        return records
+        rows   = [line.strip().split(",") for line in lines[1:]]
+        cells  = np.array(
+            [parts[:len(header)] for parts in rows if len(parts) >= len(header)],
+            dtype=str,
+        ).reshape(-1, len(header))
+        if not len(cells) or "date" not in header:
+            return []
+
+        columns = [
+            _csv_column(cells, header, *names)
+            for names in (("open",), ("high",), ("low",), ("close",),
+                          ("adj close", "adjclose"), ("volume",))
+        ]
+        open_, high, low, close, adj, volume = (values for values, _ in columns)
+        # Una celda corrupta descarta su fila: sin cierre, _yahoo_records la omite
+        close[np.logical_or.reduce([invalid for _, invalid in columns])] = np.nan
+
+        return _yahoo_records(
+            ticker,
+            cells[:, header.index("date")],
+            open_, high, low, close, adj, volume,
+        )
     except Exception as e:
         with print_lock:
             print(f"\n  [Yahoo v7 ✗] {ticker}: {e}")
@@ -409,115 +612,287 @@ def _yahoo_v7_csv(session, ticker, p1, p2, crumb) -> list:
 # UTILIDADES
 # ============================================================
 
+async def bvc_download_all(all_days: list[str], db, cached: dict[str, dict] | None = None) -> list[dict]:
+    """
+    BVC_WORKERS corrutinas consumen los índices de fecha de una cola acotada
+    (BVC_QUEUE_SIZE) sobre un único AsyncClient HTTP/2; el productor se
+    bloquea cuando la cola se llena, así que solo hay BVC_WORKERS fechas
+    descargándose a la vez. La cola acota las descargas en vuelo, no la
+    memoria total: todos los day_result se conservan en `results` hasta el
+    final (los usan el manifiesto y los JSON de main()).
+    Los contadores se actualizan a medida que terminan las fechas (todo corre
+    en el hilo del event loop); report_progress() repinta la barra.
+    Cada activo acumula registros y, al llegar a MONGO_FLUSH_ROWS, se envían
+    a su colección en `db` desde un hilo (pymongo es bloqueante).
+    Las fechas presentes en `cached` ({ fecha: day_result }, ver
+    load_manifest) se toman de ahí sin request HTTP.
+    Devuelve los day_result ({ mnemonic: record }) de las fechas con datos.
+    """
+    cached = cached or {}
+    global _bvc_session, _bvc_token_lock, _bvc_bucket
+    _bvc_token_lock = asyncio.Lock()
+    _bvc_bucket     = (TokenBucket(BVC_RATE_CAPACITY, BVC_RATE_PER_SEC)
+                       if BVC_RATE_PER_SEC else None)
+    async with httpx.AsyncClient(
+        http2=True,
+        # Una conexión por worker
+        limits=httpx.Limits(
+            max_connections=BVC_WORKERS, max_keepalive_connections=BVC_WORKERS,
+        ),
+        headers=BVC_HEADERS,
+        timeout=15,
+    ) as session:
+        _bvc_session = session
+
+        pending: dict[str, list] = {a["mnemonic"]: [] for a in BVC_ASSETS}
+        flushes = []
+
+        def flush(mn: str):
+            batch, pending[mn] = pending[mn], []
+            flushes.append(asyncio.create_task(
+                asyncio.to_thread(write_records, historico_collection(db, mn), batch)
+            ))
+
+        results = []
+
+        def collect(d: str, day_result):
+            if isinstance(day_result, Exception):
+                progress["bvc_errors"] += 1
+            elif day_result is None:
+                progress["bvc_skip"] += 1
+            else:
+                progress["bvc_ok"] += len(day_result)
+                results.append(day_result)
+                for mn, record in day_result.items():
+                    pending[mn].append(record)
+                    if len(pending[mn]) >= MONGO_FLUSH_ROWS:
+                        flush(mn)
+            progress["bvc_done"] += 1
+            progress["last_date"] = d
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=BVC_QUEUE_SIZE)
+
+        async def produce():
+            for i in range(len(all_days)):
+                await queue.put(i)   # espera si los workers van atrasados
+            for _ in range(BVC_WORKERS):
+                await queue.put(None)   # una señal de fin por worker
+
+        async def consume():
+            while (i := await queue.get()) is not None:
+                if all_days[i] in cached:
+                    progress["bvc_cached"] += 1
+                    collect(all_days[i], cached[all_days[i]])
+                    continue
+                try:
+                    day_result = await worker_day(i, all_days)
+                except Exception as e:
+                    day_result = e
+                collect(all_days[i], day_result)
+
+        reporter = asyncio.create_task(report_progress())
+        try:
+            await asyncio.gather(produce(), *(consume() for _ in range(BVC_WORKERS)))
+
+            for mn, batch in pending.items():
+                if batch:
+                    flush(mn)
+            await asyncio.gather(*flushes)
+        finally:
+            reporter.cancel()
+            print_bar(progress["last_date"])
+            _bvc_session = None
+        return results
+
+def yahoo_download_all(start: date, end: date) -> dict[str, list]:
+    """Descarga los YAHOO_ASSETS con YAHOO_WORKERS hilos. { ticker: records }."""
+    yahoo_results: dict[str, list] = {}
+    with ThreadPoolExecutor(max_workers=YAHOO_WORKERS) as executor:
+        futures_y = {
+            executor.submit(download_yahoo_ticker, ticker, start, end): ticker
+            for ticker in YAHOO_ASSETS
+        }
+        for future in as_completed(futures_y):
+            ticker = futures_y[future]
+            try:
+                records = future.result()
+                yahoo_results[ticker] = records
+                msg = f"  ✓ {ticker:<8} {len(records):>4} registros"
+            except Exception as e:
+                yahoo_results[ticker] = []
+                msg = f"  ✗ {ticker:<8} ERROR: {e}"
+            with print_lock:
+                print(f"\n  [Yahoo]{msg}")   # salto de línea: la barra BVC usa \r
+    return yahoo_results
+
+async def download_all(all_days: list[str], db, start: date, end: date,
+                       cached: dict[str, dict] | None = None) -> tuple:
+    """
+    BVC (event loop) y Yahoo (hilos, vía asyncio.to_thread) al mismo tiempo:
+    hosts distintos y sin estado compartido.
+    Devuelve ((bvc_days, seg_bvc), (yahoo_results, seg_yahoo)).
+    """
+    t0 = time.time()
+
+    async def bvc():
+        days = await bvc_download_all(all_days, db, cached)
+        return days, time.time() - t0
+
+    def yahoo():
+        results = yahoo_download_all(start, end)
+        return results, time.time() - t0
+
+    return tuple(await asyncio.gather(bvc(), asyncio.to_thread(yahoo)))
+
 def weekdays_in_range(start: date, end: date) -> list[str]:
-    days, current = [], start
-    while current <= end:
-        if current.weekday() < 5:
-            days.append(current.strftime("%Y-%m-%d"))
-        current += timedelta(days=1)
-    return days
+    """Días hábiles BVC (sin fines de semana ni festivos) entre start y end."""
+    days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+    return days[np.is_busday(days, busdaycal=_BVC_CALENDAR)].astype(str).tolist()
+
+def load_manifest() -> dict[str, dict]:
+    """
+    { targetDate: day_result } guardados por corridas anteriores. Vacío si no
+    hay manifiesto, si está corrupto o si cambió la lista de BVC_ASSETS.
+    """
+    try:
+        with open(MANIFEST_PATH, "rb") as f:
+            manifest = orjson.loads(f.read())
+    except (OSError, orjson.JSONDecodeError):
+        return {}
+    if manifest.get("assets") != sorted(_WANTED_MNEMONICS):
+        return {}
+    return manifest.get("days", {})
+
+def update_manifest(cached: dict[str, dict], bvc_days: list[dict], first_day: str) -> int:
+    """
+    Agrega al manifiesto los días descargados que ya son definitivos (todos
+    sus registros con más de FINAL_AFTER_DAYS días), descarta los anteriores
+    a first_day y lo guarda. Devuelve cuántos días nuevos se agregaron.
+    Solo se guardan días cuyos datos son de la propia fecha: un day_result
+    tomado de un día posterior puede venir de un error transitorio, y esa
+    fecha debe volver a pedirse.
+    """
+    cutoff = (date.today() - timedelta(days=FINAL_AFTER_DAYS)).isoformat()
+    days   = {d: r for d, r in cached.items() if d >= first_day}
+    before = len(days)
+    for day_result in bvc_days:
+        records = list(day_result.values())
+        if records and all(r["date"] == r["targetDate"] < cutoff for r in records):
+            days[records[0]["targetDate"]] = day_result
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    with open(MANIFEST_PATH, "wb") as f:
+        f.write(orjson.dumps({"assets": sorted(_WANTED_MNEMONICS), "days": days}))
+    return len(days) - before
 
 def save_json(path: str, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    """Serializa con orjson y escribe con os.write (sin capa de archivo de Python)."""
+    body = memoryview(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while body:
+            body = body[os.write(fd, body):]
+    finally:
+        os.close(fd)
+
+def save_all_json(files: dict[str, list]):
+    """Guarda { path: records } en paralelo — cada archivo es independiente."""
+    if not files:
+        return
+    with ThreadPoolExecutor(max_workers=min(JSON_SAVE_WORKERS, len(files))) as executor:
+        list(executor.map(save_json, files.keys(), files.values()))
 
 # ============================================================
 # MAIN
 # ============================================================
 
 def main():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    parser = argparse.ArgumentParser(description="Descarga histórica BVC + Yahoo → MongoDB")
+    parser.add_argument(
+        "--save-json",
+        action="store_true",
+        help=f"Guardar también *_historico.json y resumen_descarga.json en {OUTPUT_DIR}",
+    )
+    args = parser.parse_args()
+
+    db = get_client()[MONGO_DB_NAME]
 
     end   = date.today()
     start = end - timedelta(days=YEARS_BACK * 365)
     all_days = weekdays_in_range(start, end)
 
-    asset_set = {a["mnemonic"] for a in BVC_ASSETS}
-
     progress["bvc_total"]  = len(all_days)
     progress["start_time"] = time.time()
+    cached = load_manifest()
 
     print("=" * 65)
     print(f"  BVC TURBO DOWNLOADER")
     print(f"  Rango  : {start} → {end}")
     print(f"  Fechas : {len(all_days)} días hábiles")
     print(f"  Activos: {len(BVC_ASSETS)} BVC + {len(YAHOO_ASSETS)} Yahoo")
-    print(f"  Hilos  : {BVC_WORKERS} BVC | {YAHOO_WORKERS} Yahoo (en paralelo)")
+    print(f"  Concur.: {BVC_WORKERS} BVC (asyncio) | {YAHOO_WORKERS} hilos Yahoo")
     print(f"  Truco  : 1 request/fecha = todos los activos a la vez")
+    print(f"  Caché  : {len(cached)} fechas definitivas en {os.path.basename(MANIFEST_PATH)}")
     print("=" * 65)
 
-    # ---------- BVC ----------
-    print(f"\n[BVC] Iniciando descarga...\n")
-    all_results: dict[str, list] = {a["mnemonic"]: [] for a in BVC_ASSETS}
+    # ---------- BVC + Yahoo (en paralelo) ----------
+    print(f"\n[BVC + Yahoo] Iniciando descargas en paralelo...\n")
 
-    with ThreadPoolExecutor(max_workers=BVC_WORKERS) as executor:
-        futures = {
-            executor.submit(worker_day, d, asset_set): d
-            for d in all_days
-        }
-        for future in as_completed(futures):
-            try:
-                day_result = future.result()
-                for mn, record in day_result.items():
-                    all_results[mn].append(record)
-            except Exception:
-                with print_lock:
-                    progress["bvc_errors"] += 1
-
-    elapsed_bvc = time.time() - progress["start_time"]
-    print(f"\n\n[BVC] Completado en {elapsed_bvc:.1f}s")
-
-    # ---------- Yahoo (paralelo) ----------
-    print(f"\n[Yahoo] Iniciando descarga de {len(YAHOO_ASSETS)} tickers...\n")
-    yahoo_results: dict[str, list] = {}
-    t_yahoo = time.time()
+    run = uvloop.run if uvloop is not None else asyncio.run
+    (bvc_days, elapsed_bvc), (yahoo_results, elapsed_yahoo) = run(
+        download_all(all_days, db, start, end, cached)
+    )
+    new_final = update_manifest(cached, bvc_days, all_days[0])
 
-    with ThreadPoolExecutor(max_workers=YAHOO_WORKERS) as executor:
-        futures_y = {
-            executor.submit(download_yahoo_ticker, ticker, start, end): ticker
-            for ticker in YAHOO_ASSETS
-        }
-        for future in as_completed(futures_y):
-            ticker = futures_y[future]
-            try:
-                records = future.result()
-                yahoo_results[ticker] = records
-                print(f"  ✓ {ticker:<8} {len(records):>4} registros")
-            except Exception as e:
-                yahoo_results[ticker] = []
-                print(f"  ✗ {ticker:<8} ERROR: {e}")
+    # Cada registro va a la posición de su targetDate en all_days: la lista
+    # queda en orden cronológico sin ordenar (date crece con targetDate)
+    date_to_idx = {d: i for i, d in enumerate(all_days)}
+    slots: dict[str, list] = {a["mnemonic"]: [None] * len(all_days) for a in BVC_ASSETS}
+    for day_result in bvc_days:
+        for mn, record in day_result.items():
+            slots[mn][date_to_idx[record["targetDate"]]] = record
+    all_results = {mn: [r for r in lst if r is not None] for mn, lst in slots.items()}
 
-    elapsed_yahoo = time.time() - t_yahoo
+    print(f"\n\n[BVC] Completado en {elapsed_bvc:.1f}s | [Yahoo] {elapsed_yahoo:.1f}s")
+    print(f"[BVC] {progress['bvc_cached']} fechas desde el manifiesto | "
+          f"{new_final} nuevas fechas definitivas guardadas")
 
     # ---------- Guardar ----------
     print(f"\n{'='*65}")
-    print("GUARDANDO ARCHIVOS...")
+    print("GUARDANDO EN MONGODB" + (" + ARCHIVOS JSON..." if args.save_json else "..."))
     total_records = 0
+    json_files: dict[str, list] = {}   # se escriben todos juntos al final
 
+    # Los registros BVC ya se enviaron durante la descarga
     for mn, records in all_results.items():
-        records.sort(key=lambda x: x["date"])
-        path = os.path.join(OUTPUT_DIR, f"{mn}_historico.json")
-        save_json(path, records)
+        json_files[os.path.join(OUTPUT_DIR, f"{mn}_historico.json")] = records
         total_records += len(records)
         status = "✓" if records else "⚠ sin datos"
         print(f"  {status} {mn:<20} {len(records):>4} registros")
 
     for ticker, records in yahoo_results.items():
-        path = os.path.join(OUTPUT_DIR, f"{ticker}_historico.json")
-        save_json(path, records)
+        write_records(historico_collection(db, ticker), records)
+        json_files[os.path.join(OUTPUT_DIR, f"{ticker}_historico.json")] = records
         total_records += len(records)
         status = "✓" if records else "⚠ sin datos"
         print(f"  {status} {ticker:<20} {len(records):>4} registros")
 
+    if args.save_json:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        save_all_json(json_files)
+
     # ---------- Resumen ----------
     elapsed_total = time.time() - progress["start_time"]
     print(f"\n{'='*65}")
     print(f"  COMPLETADO")
     print(f"  BVC   : {elapsed_bvc:.1f}s  ({len(all_days)/elapsed_bvc:.1f} fechas/seg)")
     print(f"  Yahoo : {elapsed_yahoo:.1f}s")
-    print(f"  Total : {elapsed_total:.1f}s | {total_records} registros | {OUTPUT_DIR}/")
+    print(f"  Total : {elapsed_total:.1f}s | {total_records} registros | MongoDB '{MONGO_DB_NAME}'")
     print(f"{'='*65}")
 
+    if not args.save_json:
+        return
+
     save_json(os.path.join(OUTPUT_DIR, "resumen_descarga.json"), {
         "fecha_descarga":     date.today().isoformat(),
         "rango":              {"inicio": start.isoformat(), "fin": end.isoformat()},
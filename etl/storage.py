@@ -5,45 +5,54 @@ Loads all historical JSON files from the `historicos/` folder
 and upserts each record into MongoDB Atlas.
 
 Each stock gets its own collection named after its mnemonic (e.g. ECOPETROL, GEB).
-Documents are upserted by the `date` field so re-running is safe.
+Collections carry a unique index on `date`. Empty collections are filled
+with insert_many; otherwise (and for duplicate dates) documents are upserted
+by `date`, so re-running is safe.
+
+`etl.finalInfoScript` streams freshly downloaded records straight into the
+same collections through `write_records`; this module's CLI re-uploads the
+JSON dumps.
 
 Usage:
     python -m etl.storage
 """
 
-import json
-import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
+import orjson
+
 from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
 
-# ── MongoDB connection ────────────────────────────────────────────────────────
-MONGO_URI: str = os.getenv("MONGO_URI", "")
-if not MONGO_URI:
-    raise EnvironmentError(
-        "MONGO_URI is not set. Please add it to your .env file.\n"
-        "See .env.example for reference."
-    )
-DB_NAME = "nexvest"
+# Shared MongoClient singleton (same pool as the API) — see database.py
+from database import MONGO_DB_NAME, close_connection, get_client
 
 # ── Path to historical data ───────────────────────────────────────────────────
 HISTORICOS_DIR = Path(__file__).resolve().parent.parent / "historicos"
 
+# ── Upload tuning ─────────────────────────────────────────────────────────────
+BATCH_SIZE = 1000     # operations per bulk_write (keeps each batch well under 16 MB)
+UPLOAD_WORKERS = 8    # files uploaded in parallel over the client's pool
 
-def get_client() -> MongoClient:
-    """Create and return a MongoClient, verifying the connection with a ping."""
-    client = MongoClient(MONGO_URI, server_api=ServerApi("1"))
-    client.admin.command("ping")
-    print("Connected to MongoDB Atlas successfully.")
-    return client
+# Unacknowledged writes: the client does not wait for the server per batch.
+# Safe for this ETL because every write is an upsert filtered on `date`,
+# so a re-run converges to the same data.
+ETL_WRITE_CONCERN = WriteConcern(w=0)
+
+DUPLICATE_KEY = 11000
+
+# Collections whose unique `date` index has already been ensured in this run
+_indexed: set[str] = set()
+_indexed_lock = threading.Lock()
 
 
 def load_json(file_path: Path) -> list[dict]:
     """Read a JSON file and return the list of records."""
-    with open(file_path, encoding="utf-8") as f:
-        data = json.load(f)
+    with open(file_path, "rb") as f:
+        data = orjson.loads(f.read())
     # Keep only well-formed records (must have at least a date)
     valid = [r for r in data if isinstance(r, dict) and r.get("date")]
     dropped = len(data) - len(valid)
@@ -54,12 +63,13 @@ def load_json(file_path: Path) -> list[dict]:
 
 def upsert_records(collection, records: list[dict]) -> dict:
     """
-    Bulk-upsert records into `collection`.
+    Bulk-upsert records into `collection` in batches of BATCH_SIZE.
     Each record is matched by its `date` field.
-    Returns a summary dict with upserted/modified counts.
+    Returns a summary dict with sent/upserted/modified counts; the last two
+    stay at 0 when `collection` uses an unacknowledged write concern.
     """
     if not records:
-        return {"upserted": 0, "modified": 0}
+        return {"sent": 0, "upserted": 0, "modified": 0}
 
     operations = [
         UpdateOne(
@@ -70,17 +80,94 @@ def upsert_records(collection, records: list[dict]) -> dict:
         for rec in records
     ]
 
-    result = collection.bulk_write(operations, ordered=False)
-    return {
-        "upserted": result.upserted_count,
-        "modified": result.modified_count,
-    }
+    summary = {"sent": len(operations), "upserted": 0, "modified": 0}
+    for i in range(0, len(operations), BATCH_SIZE):
+        # No bypass_document_validation here: pymongo refuses it together
+        # with the unacknowledged ETL_WRITE_CONCERN
+        result = collection.bulk_write(operations[i:i + BATCH_SIZE], ordered=False)
+        if result.acknowledged:
+            summary["upserted"] += result.upserted_count
+            summary["modified"] += result.modified_count
+    return summary
+
+
+def ensure_date_index(collection) -> None:
+    """Create the unique `date` index once per collection (acknowledged)."""
+    with _indexed_lock:
+        if collection.full_name in _indexed:
+            return
+        collection.with_options(write_concern=WriteConcern()).create_index("date", unique=True)
+        _indexed.add(collection.full_name)
+
+
+def insert_records(collection, records: list[dict]) -> dict:
+    """
+    First-load path: insert_many in batches of BATCH_SIZE, relying on the
+    unique `date` index. Records rejected as duplicate keys are re-sent
+    through upsert_records (last record for a date wins, as with upserts).
+    Inserts are acknowledged — duplicate-key errors are only reported then.
+    Returns a summary dict with inserted/upserted counts.
+    """
+    acked = collection.with_options(write_concern=WriteConcern())
+    ensure_date_index(acked)
+
+    inserted, conflicts = 0, []
+    for i in range(0, len(records), BATCH_SIZE):
+        batch = records[i:i + BATCH_SIZE]
+        # insert_many adds `_id` to the documents it receives, so send copies
+        docs = [dict(rec) for rec in batch]
+        try:
+            inserted += len(acked.insert_many(
+                docs, ordered=False, bypass_document_validation=True,
+            ).inserted_ids)
+        except BulkWriteError as exc:
+            errors = exc.details.get("writeErrors", [])
+            if any(err.get("code") != DUPLICATE_KEY for err in errors):
+                raise
+            inserted += exc.details.get("nInserted", 0)
+            conflicts.extend(batch[err["index"]] for err in errors)
+
+    upserted = upsert_records(collection, conflicts)["sent"] if conflicts else 0
+    return {"inserted": inserted, "upserted": upserted}
+
+
+def write_records(collection, records: list[dict]) -> dict:
+    """
+    Write `records` into `collection`: insert_many when the collection is
+    still empty, bulk upserts otherwise. Returns {"inserted", "upserted"}.
+    """
+    if not records:
+        return {"inserted": 0, "upserted": 0}
+    ensure_date_index(collection)
+    if collection.estimated_document_count() == 0:
+        return insert_records(collection, records)
+    return {"inserted": 0, "upserted": upsert_records(collection, records)["sent"]}
+
+
+def historico_collection(db, mnemonic: str):
+    """Return the ETL handle (w=0) for `mnemonic`, e.g. ECOPETROL → historico_ecopetrol."""
+    return db.get_collection(f"historico_{mnemonic.lower()}", write_concern=ETL_WRITE_CONCERN)
+
+
+def upload_file(db, file_path: Path) -> None:
+    """Load one *_historico.json file and write it into its collection."""
+    # Derive mnemonic from filename, e.g. ECOPETROL_historico.json → ECOPETROL
+    mnemonic = file_path.stem.replace("_historico", "")
+    collection = historico_collection(db, mnemonic)
+
+    records = load_json(file_path)
+    summary = write_records(collection, records)
+    print(
+        f"  {file_path.name} → '{collection.name}': "
+        f"inserted: {summary['inserted']}, upserts sent: {summary['upserted']}"
+    )
 
 
 def upload_historicos(historicos_dir: Path = HISTORICOS_DIR) -> None:
     """
-    Iterate over every *_historico.json file in `historicos_dir`,
-    derive the collection name from the mnemonic, and upsert all records.
+    Upload every *_historico.json file in `historicos_dir` to its own
+    collection. Files are processed in parallel (UPLOAD_WORKERS threads)
+    sharing the same MongoClient connection pool.
     """
     json_files = sorted(historicos_dir.glob("*_historico.json"))
 
@@ -88,23 +175,15 @@ def upload_historicos(historicos_dir: Path = HISTORICOS_DIR) -> None:
         print(f"No *_historico.json files found in {historicos_dir}")
         return
 
-    client = get_client()
-    db = client[DB_NAME]
-
-    for file_path in json_files:
-        # Derive mnemonic from filename, e.g. ECOPETROL_historico.json → ECOPETROL
-        mnemonic = file_path.stem.replace("_historico", "")
-        collection_name = f"historico_{mnemonic.lower()}"
-
-        print(f"\nProcessing {file_path.name} → collection '{collection_name}' ...")
-        records = load_json(file_path)
-        print(f"  Loaded {len(records)} valid records.")
+    db = get_client()[MONGO_DB_NAME]
 
-        collection = db[collection_name]
-        summary = upsert_records(collection, records)
-        print(f"  Done — upserted: {summary['upserted']}, modified: {summary['modified']}")
+    print(f"\nUploading {len(json_files)} file(s) with {UPLOAD_WORKERS} workers ...")
+    with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        futures = [executor.submit(upload_file, db, fp) for fp in json_files]
+        for future in futures:
+            future.result()   # re-raise the first upload error, if any
 
-    client.close()
+    close_connection()
     print("\nAll files uploaded. Connection closed.")
 
 
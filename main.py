@@ -29,8 +29,9 @@ from typing import Dict, Any
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 
+from database import MONGO_DB_NAME, ensure_historico_indexes, get_client
 from routers import analisis, historicos
 
 # ── Logger ────────────────────────────────────────────────────────────────────
@@ -52,6 +53,8 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc",
     openapi_url="/openapi.json",
+    # orjson serializa las respuestas (y los tipos NumPy) más rápido que json
+    default_response_class=ORJSONResponse,
 )
 
 logger.info("Iniciando configuración de NexVest API")
@@ -76,6 +79,22 @@ app.include_router(analisis.router, prefix="/api")
 logger.debug("Routers registrados: /historicos, /analisis")
 
 
+# ── Startup ───────────────────────────────────────────────────────────────────
+
+@app.on_event("startup")
+def create_indexes() -> None:
+    """
+    Asegura el índice sobre `date` en las colecciones históricas.
+    
+    Un fallo aquí (p. ej. MongoDB no disponible) no impide arrancar la API;
+    los endpoints reportarán el error al consultar.
+    """
+    try:
+        ensure_historico_indexes(get_client()[MONGO_DB_NAME])
+    except Exception as exc:
+        logger.warning(f"No se pudieron verificar los índices: {exc}")
+
+
 # ── Health Check Endpoints ────────────────────────────────────────────────────
 
 @app.get(
@@ -147,7 +166,7 @@ def health_check() -> Dict[str, Any]:
 # ── Error Handlers ────────────────────────────────────────────────────────────
 
 @app.exception_handler(Exception)
-def global_exception_handler(request, exc: Exception) -> JSONResponse:
+def global_exception_handler(request, exc: Exception) -> ORJSONResponse:
     """
     Maneja excepciones no capturadas en la aplicación.
     
@@ -156,10 +175,10 @@ def global_exception_handler(request, exc: Exception) -> JSONResponse:
         exc: Excepción no manejada
         
     Returns:
-        JSONResponse con información del error
+        ORJSONResponse con información del error
     """
     logger.error(f"Excepción no manejada: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={
             "status": "error",
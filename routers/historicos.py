@@ -28,7 +28,7 @@ Features:
     - Filtrado por rango de fechas
     - Limit configurable
     - Validación de mnemonics
-    - Serialización automática de documentos MongoDB
+    - Proyección de _id en MongoDB y serialización con orjson
     - Manejo robusto de errores
     - Logging detallado de operaciones
 
@@ -49,9 +49,15 @@ Version:
 """
 
 import logging
-from typing import Optional, List, Dict, Any
+import threading
+from functools import lru_cache
+from itertools import islice
+from typing import Optional, List, Dict, Any, Iterator, Set
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+import orjson
+from cachetools import TTLCache
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from fastapi.responses import StreamingResponse
 from pymongo.database import Database
 from pymongo.cursor import Cursor
 
@@ -91,15 +97,29 @@ KNOWN_MNEMONICS: List[str] = [
     "promigas",
 ]
 
+# Formato válido de mnemónico: letras (con tildes), dígitos y punto (ej: CSPX.L).
+# FastAPI rechaza con 422 lo que no cumpla, sin consultar MongoDB.
+MNEMONIC_PATTERN: str = r"^[A-Za-z0-9.ÁÉÍÓÚÑÜáéíóúñü]{1,20}$"
+
 # Default limit para queries sin date range
 DEFAULT_LIMIT: int = 100
 
 # Default sort order
 DEFAULT_SORT: int = 1  # 1 para ascendente, -1 para descendente
 
+# Registros serializados por cada chunk de la respuesta en streaming
+STREAM_CHUNK_ROWS: int = 500
+
+# Nombres de colecciones cacheados — evita un list_collection_names() por
+# request. Las colecciones que cree el ETL aparecen en máximo TTL segundos.
+COLLECTIONS_TTL: int = 60
+_collections_cache: TTLCache = TTLCache(maxsize=1, ttl=COLLECTIONS_TTL)
+_collections_lock = threading.Lock()
+
 
 # ── Utility Functions ─────────────────────────────────────────────────────────
 
+@lru_cache(maxsize=128)
 def _collection_name(mnemonic: str) -> str:
     """
     Convierte un mnemónico a nombre de colección MongoDB.
@@ -117,28 +137,22 @@ def _collection_name(mnemonic: str) -> str:
     return f"historico_{mnemonic.lower()}"
 
 
-def _serialize(doc: Dict[str, Any]) -> Dict[str, Any]:
+def _collections(db: Database) -> Set[str]:
     """
-    Convierte documento MongoDB a dict JSON-serializable.
-    
-    Elimina el campo _id que MongoDB añade automáticamente,
-    ya que no es necesario en la respuesta API.
+    Retorna los nombres de colecciones de la base, cacheados COLLECTIONS_TTL s.
     
     Args:
-        doc: Documento MongoDB
+        db: Base de datos MongoDB
         
     Returns:
-        Dict sin el campo _id
-        
-    Example:
-        >>> doc = {"_id": ObjectId(...), "date": "2024-01-01", "close": 100}
-        >>> _serialize(doc)
-        {'date': '2024-01-01', 'close': 100}
+        Set[str]: Nombres de colecciones existentes
     """
-    if doc is None:
-        return {}
-    doc.pop("_id", None)
-    return doc
+    with _collections_lock:
+        names = _collections_cache.get("names")
+        if names is None:
+            names = set(db.list_collection_names())
+            _collections_cache["names"] = names
+        return names
 
 
 def _validate_date_format(date_str: str) -> bool:
@@ -172,6 +186,47 @@ def _validate_date_format(date_str: str) -> bool:
         return False
 
 
+def _stream_historico(
+    cursor: Cursor,
+    meta: Dict[str, Any],
+    first: List[Dict[str, Any]],
+) -> Iterator[bytes]:
+    """
+    Serializa la respuesta de get_historico a medida que se lee el cursor.
+    
+    Emite un único objeto JSON con los campos de `meta`, seguidos de
+    "data" (los registros, codificados con orjson en chunks de
+    STREAM_CHUNK_ROWS) y, al final, "total" y "status". Así el servidor no
+    materializa todos los documentos en memoria.
+    
+    Args:
+        cursor: Cursor MongoDB ya filtrado, ordenado y limitado
+        meta: Campos de cabecera de la respuesta (mnemonic, desde, ...)
+        first: Primer chunk, ya leído del cursor por get_historico
+        
+    Yields:
+        bytes: Fragmentos consecutivos del JSON de respuesta
+    """
+    yield orjson.dumps(meta)[:-1] + b',"data":['
+    total = 0
+    chunk: List[bytes] = [orjson.dumps(doc) for doc in first]
+    try:
+        for doc in cursor:
+            chunk.append(orjson.dumps(doc))
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield (b"," if total else b"") + b",".join(chunk)
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            yield (b"," if total else b"") + b",".join(chunk)
+            total += len(chunk)
+    finally:
+        cursor.close()
+
+    yield b'],"total":' + str(total).encode() + b',"status":"ok"}'
+    logger.info(f"Query exitoso: {meta['mnemonic']} - {total} registros enviados")
+
+
 # ── Endpoints ─────────────────────────────────────────────────────────────────
 
 @router.get(
@@ -203,7 +258,7 @@ def list_mnemonics(db: Database = Depends(get_db)) -> Dict[str, Any]:
     """
     try:
         logger.debug("Listando mnemonics disponibles")
-        collections = db.list_collection_names()
+        collections = _collections(db)
         
         mnemonics = [
             c.replace("historico_", "").upper()
@@ -233,7 +288,11 @@ def list_mnemonics(db: Database = Depends(get_db)) -> Dict[str, Any]:
     response_description="Registros históricos con fecha, precio y volumen"
 )
 def get_historico(
-    mnemonic: str = Query(..., description="Símbolo de la acción (ej: ECOPETROL)"),
+    mnemonic: str = Path(
+        ...,
+        pattern=MNEMONIC_PATTERN,
+        description="Símbolo de la acción (ej: ECOPETROL)"
+    ),
     desde: Optional[str] = Query(
         None,
         description="Fecha inicio YYYY-MM-DD (inclusive)",
@@ -251,7 +310,7 @@ def get_historico(
         description="Máximo de registros a retornar. Sin filtro de fechas, default es 100."
     ),
     db: Database = Depends(get_db),
-) -> Dict[str, Any]:
+) -> StreamingResponse:
     """
     Retorna registros históricos para un mnemónico con filtros opcionales.
     
@@ -261,7 +320,11 @@ def get_historico(
         - Si se especifica limit: se respeta independientemente de fechas
     
     Comportamiento de ordenamiento:
-        Los resultados siempre se ordenan por fecha ascendente (más antiguos primero).
+        Los resultados siempre se ordenan por fecha ascendente (más antiguos primero),
+        usando el índice sobre `date` de la colección.
+    
+    La respuesta se envía en streaming: los registros se serializan a medida
+    que llegan del cursor, y "total" va al final del objeto.
     
     Args:
         mnemonic: Símbolo de acción (ej: "ECOPETROL")
@@ -271,11 +334,11 @@ def get_historico(
         db: Dependencia de base de datos
         
     Returns:
-        Dict con:
+        StreamingResponse con un JSON que contiene:
             - mnemonic: Símbolo consultado
-            - total: Cantidad de registros retornados
             - desde/hasta: Fechas de filtro (si aplican)
             - data: Lista de registros históricos
+            - total: Cantidad de registros retornados
             
     Raises:
         HTTPException 404: Si el mnemónico no existe
@@ -285,9 +348,9 @@ def get_historico(
     Response Example:
         {
             "mnemonic": "ECOPETROL",
-            "total": 5,
             "desde": "2024-01-01",
             "hasta": "2024-01-05",
+            "limit_applied": null,
             "data": [
                 {
                     "date": "2024-01-01",
@@ -298,7 +361,9 @@ def get_historico(
                     "low": 2630.0
                 },
                 ...
-            ]
+            ],
+            "total": 5,
+            "status": "ok"
         }
     """
     try:
@@ -321,7 +386,7 @@ def get_historico(
         
         # Verificar que la colección existe
         col_name = _collection_name(mnemonic)
-        if col_name not in db.list_collection_names():
+        if col_name not in _collections(db):
             logger.info(f"Mnemónico no encontrado: {mnemonic}")
             raise HTTPException(
                 status_code=404,
@@ -356,22 +421,29 @@ def get_historico(
         if effective_limit is not None:
             cursor = cursor.limit(effective_limit)
         
-        records = list(cursor)
+        # El primer chunk se lee aquí: los errores de la query o de conexión
+        # salen antes de enviar los headers y se responden con 500
+        try:
+            first = list(islice(cursor, STREAM_CHUNK_ROWS))
+        except Exception:
+            cursor.close()
+            raise
         
-        logger.info(
-            f"Query exitoso: {mnemonic.upper()} - {len(records)} registros "
+        logger.debug(
+            f"Enviando {mnemonic.upper()} en streaming "
             f"(desde={desde}, hasta={hasta}, limit={limit})"
         )
         
-        return {
+        meta = {
             "mnemonic": mnemonic.upper(),
-            "total": len(records),
             "desde": desde,
             "hasta": hasta,
             "limit_applied": effective_limit,
-            "data": records,
-            "status": "ok"
         }
+        return StreamingResponse(
+            _stream_historico(cursor, meta, first),
+            media_type="application/json",
+        )
         
     except HTTPException:
         raise
@@ -389,8 +461,8 @@ def get_historico(
     response_description="Registro histórico para una fecha exacta"
 )
 def get_historico_by_date(
-    mnemonic: str = Query(..., description="Símbolo de la acción"),
-    date: str = Query(..., description="Fecha exact (YYYY-MM-DD)", example="2024-01-15"),
+    mnemonic: str = Path(..., pattern=MNEMONIC_PATTERN, description="Símbolo de la acción"),
+    date: str = Path(..., description="Fecha exact (YYYY-MM-DD)", example="2024-01-15"),
     db: Database = Depends(get_db),
 ) -> Dict[str, Any]:
     """
@@ -440,7 +512,7 @@ def get_historico_by_date(
         
         # Verificar que la colección existe
         col_name = _collection_name(mnemonic)
-        if col_name not in db.list_collection_names():
+        if col_name not in _collections(db):
             logger.info(f"Mnemónico no encontrado: {mnemonic}")
             raise HTTPException(
                 status_code=404,